@@ -1,34 +1,37 @@
-import json
-import pandas as pd
+import orjson
 import numpy as np
-from sklearn.linear_model import LinearRegression
+import scipy.linalg
 
 # Load data from marketData.json
-with open("market_data.json", "r") as file:
-    data = json.load(file)
+with open("market_data.json", "rb") as file:
+    data = orjson.loads(file.read())
 
-# Convert JSON data into a DataFrame
-df = pd.DataFrame(data['data'])
+# Convert JSON records straight into feature and target arrays
+records = data['data']
+raw_predictions = np.fromiter((r['rawPrediction'] for r in records), dtype=np.float32, count=len(records))
+sentiments = np.fromiter((r['sentiment'] for r in records), dtype=np.float32, count=len(records))
+y = np.fromiter((r['price'] for r in records), dtype=np.float32, count=len(records))
 
 # Ensure sentiment scores are normalized
 def normalize_sentiment(sentiments):
-    min_sent = np.min(sentiments)
-    max_sent = np.max(sentiments)
-    return (sentiments - min_sent) / (max_sent - min_sent) if max_sent > min_sent else sentiments
-
-df['normalized_sentiment'] = normalize_sentiment(df['sentiment'].values)
-
-# Prepare features (rawPrediction and normalized_sentiment) and target (price)
-X = df[['rawPrediction', 'normalized_sentiment']].values
-y = df['price'].values
-
-# Fit a linear regression model to find optimal coefficients
-model = LinearRegression()
-model.fit(X, y)
+    normalized = sentiments.astype(np.float32, copy=True)
+    min_sent = normalized.min()
+    sent_range = normalized.max() - min_sent
+    if sent_range > 0:
+        normalized -= min_sent
+        normalized *= 1.0 / sent_range
+    return normalized
+
+# Prepare features (rawPrediction and normalized_sentiment); price is the target
+X = np.column_stack([raw_predictions, normalize_sentiment(sentiments)])
+
+# Fit a least-squares linear model, with a column of ones for the intercept.
+# Everything is float32, so gelsy runs in single precision (sgelsy)
+A = np.column_stack([X, np.ones(len(X), dtype=np.float32)])
+coef, *_ = scipy.linalg.lstsq(A, y, lapack_driver='gelsy')
 
 # Retrieve coefficients
-alpha, beta = model.coef_
-intercept = model.intercept_
+alpha, beta, intercept = coef
 
 # Display the calculated coefficients
 print(f"Optimal Coefficients:")
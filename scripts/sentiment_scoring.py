@@ -0,0 +1,44 @@
+# sentiment_scoring.py
+# Scoring helpers used by the news sentiment UDF. Kept in an importable module
+# (shipped to executors with addPyFile) so the analyzer and score cache are
+# module globals that live for the whole Python worker.
+import functools
+from textblob.sentiments import PatternAnalyzer
+
+# Texts are truncated to this many characters before scoring, so one
+# oversized description cannot stall the batch it belongs to
+MAX_SENTIMENT_TEXT_LENGTH = 2000
+
+_analyzer = None
+
+def _get_analyzer():
+    """Return this worker's PatternAnalyzer, created on first use.
+
+    TextBlob already shares one class-level PatternAnalyzer; calling it
+    directly only skips constructing a TextBlob for every text.
+    """
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = PatternAnalyzer()
+    return _analyzer
+
+def clean_text(text):
+    """Clean text - remove extra whitespace, convert to lowercase, cap length"""
+    return ' '.join(text.split()).lower()[:MAX_SENTIMENT_TEXT_LENGTH]
+
+# Memoized on the cleaned text, since aggregator feeds repost identical
+# headlines; callers pass clean_text() output so cache keys stay bounded
+@functools.lru_cache(maxsize=200_000)
+def analyze_sentiment(text):
+    """Analyze sentiment of cleaned text using TextBlob with enhanced processing"""
+    if not text:
+        return 0.0
+    
+    # Get both polarity and subjectivity
+    polarity, subjectivity = _get_analyzer().analyze(text)
+    
+    # Weight the sentiment by subjectivity
+    # This helps distinguish between factual and opinion-based content
+    weighted_sentiment = polarity * (0.5 + 0.5 * subjectivity)
+    
+    return weighted_sentiment
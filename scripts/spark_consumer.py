@@ -1,6 +1,8 @@
 # spark_timeseries_analysis.py
 import os
 import sys
+import threading
+import itertools
 import urllib.request
 from pathlib import Path
 from pyspark.sql.functions import *
@@ -12,6 +14,15 @@ from pyspark.sql.window import Window
 import pandas as pd
 from pyspark.sql import DataFrame
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+
+# Driver-side Cassandra session and prepared inserts, shared across micro-batches
+_cassandra_session = None
+_cassandra_lock = threading.Lock()
+_insert_statements = {}
+
+# Rows pulled from Spark and handed to the concurrent executor at a time
+INSERT_CHUNK_SIZE = 1000
 
 def setup_hadoop_binaries():
     """Download and setup Hadoop binaries for Windows"""
@@ -47,6 +58,8 @@ def create_spark_session():
         .appName("StockTimeSeriesAnalysis") \
         .config("spark.jars.packages", "org.apache.spark:spark-sql-kafka-0-10_2.12:3.2.0") \
         .config("spark.sql.shuffle.partitions", "2") \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
         .config("spark.driver.memory", "2g") \
         .config("spark.executor.memory", "2g") \
         .master("local[*]") \
@@ -117,7 +130,7 @@ def train_model(df):
 def process_batch(df, epoch_id):
     """Process each batch of data with time series analysis"""
     try:
-        if df.rdd.isEmpty():
+        if not df.take(1):
             print(f"Batch {epoch_id}: No data received")
             return
         
@@ -162,29 +175,56 @@ def process_batch(df, epoch_id):
     except Exception as e:
         print(f"Error processing batch {epoch_id}: {str(e)}")
 
+def _get_cassandra_session():
+    """Return the shared Cassandra session, connecting on first use"""
+    global _cassandra_session
+    with _cassandra_lock:
+        if _cassandra_session is None:
+            cluster = Cluster(['localhost'], port=9042)
+            _cassandra_session = cluster.connect()
+        return _cassandra_session
+
+def _get_insert_statement(keyspace: str, table: str):
+    """Create the prediction table and prepare its insert once per process"""
+    session = _get_cassandra_session()
+    with _cassandra_lock:
+        if (keyspace, table) not in _insert_statements:
+            # Create the table if it doesn't exist
+            create_table_query = f"""
+            CREATE TABLE IF NOT EXISTS {keyspace}.{table} (
+                symbol text,
+                timestamp timestamp,
+                prediction float,
+                price float,
+                volume int,
+                PRIMARY KEY (timestamp, symbol)
+            )"""
+            session.execute(create_table_query)
+
+            _insert_statements[(keyspace, table)] = session.prepare(
+                f"INSERT INTO {keyspace}.{table} (timestamp, symbol, prediction, price, volume) VALUES (?, ?, ?, ?, ?)"
+            )
+        return _insert_statements[(keyspace, table)]
+
 def save_to_cassandra(df: DataFrame, keyspace: str, table: str):
-    # Connect to the Cassandra cluster
-    cluster = Cluster(['localhost'], port=9042)
-    session = cluster.connect(keyspace)
-
-    # Create the table if it doesn't exist
-    create_table_query = f"""
-    CREATE TABLE IF NOT EXISTS {table} (
-        symbol text,
-        timestamp timestamp,
-        prediction float,
-        price float,
-        volume int,
-        PRIMARY KEY (timestamp, symbol)
-    )"""
-    session.execute(create_table_query)
-
-    # Insert data
-    insert_query = session.prepare(f"INSERT INTO {table} (timestamp, symbol, prediction, price, volume) VALUES (?, ?, ?, ?, ?)")
-
-    # Use a batch for efficiency
-    for row in df.collect():
-        session.execute(insert_query, (row.timestamp, row.symbol, row.prediction, row.price, int(row.volume)))
+    session = _get_cassandra_session()
+    insert_query = _get_insert_statement(keyspace, table)
+
+    # Stream rows partition by partition, reading them on this thread in fixed
+    # chunks so the driver's IO loop never waits on Spark, and drain each
+    # chunk's results as they complete instead of accumulating them
+    rows = df.select("timestamp", "symbol", "prediction", "price", "volume") \
+        .toLocalIterator(prefetchPartitions=True)
+    while True:
+        chunk = [
+            (row.timestamp, row.symbol, row.prediction, row.price, int(row.volume))
+            for row in itertools.islice(rows, INSERT_CHUNK_SIZE)
+        ]
+        if not chunk:
+            break
+        for _ in execute_concurrent_with_args(session, insert_query, chunk,
+                                              concurrency=100, results_generator=True):
+            pass
 
     print(f"Data saved to table {table} under keyspace {keyspace}.")
 
@@ -7,10 +7,33 @@ from pyspark.sql.functions import *
 from pyspark.sql.types import *
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from pyspark.sql import DataFrame
+from pyspark import StorageLevel
 from cassandra.cluster import Cluster
 import urllib.request
 import json
-from textblob import TextBlob
+import threading
+import numpy as np
+import pandas as pd
+from sentiment_scoring import analyze_sentiment, clean_text
+
+# Micro-batch trigger interval, tune to observed batch processing time
+BATCH_INTERVAL = os.getenv("BATCH_INTERVAL", "10 seconds")
+
+# Upper bound on Kafka offsets read per micro-batch, so a backlog is spread
+# over several triggers instead of one oversized batch
+MAX_OFFSETS_PER_TRIGGER = os.getenv("MAX_OFFSETS_PER_TRIGGER", "1000")
+
+# Shuffle partitions for the per-company aggregation, two per local core by default
+SHUFFLE_PARTITIONS = int(os.getenv("SHUFFLE_PARTITIONS", (os.cpu_count() or 1) * 2))
+
+# Rows per Arrow batch handed to the pandas UDF. This is Spark's default,
+# pinned here so the UDF batch size is explicit
+ARROW_MAX_RECORDS_PER_BATCH = "10000"
+
+# Driver-side Cassandra session, shared across micro-batches
+_cassandra_session = None
+_cassandra_lock = threading.Lock()
+_created_tables = set()
 
 def setup_hadoop_binaries():
     """Download and setup Hadoop binaries for Windows"""
@@ -44,74 +67,80 @@ def create_spark_session():
     
     return SparkSession.builder \
         .appName("NewsStreamingSentiment") \
-        .config("spark.jars.packages", "org.apache.spark:spark-sql-kafka-0-10_2.12:3.2.0") \
-        .config("spark.sql.shuffle.partitions", "2") \
+        .config("spark.jars.packages",
+                "org.apache.spark:spark-sql-kafka-0-10_2.12:3.2.0,"
+                "com.datastax.spark:spark-cassandra-connector_2.12:3.2.0") \
+        .config("spark.cassandra.connection.host", "localhost") \
+        .config("spark.cassandra.connection.port", "9042") \
+        .config("spark.sql.shuffle.partitions", str(SHUFFLE_PARTITIONS)) \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
         .config("spark.driver.memory", "2g") \
         .config("spark.executor.memory", "2g") \
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+        .config("spark.sql.execution.arrow.maxRecordsPerBatch", ARROW_MAX_RECORDS_PER_BATCH) \
+        .config("spark.sql.streaming.minBatchesToRetain", "5") \
         .master("local[*]") \
         .getOrCreate()
 
-def analyze_sentiment(text):
-    """Analyze sentiment of text using TextBlob with enhanced processing"""
-    if not text:
-        return 0.0
-    
-    # Clean text - remove extra whitespace, convert to lowercase
-    text = ' '.join(text.split()).lower()
-    
-    blob = TextBlob(text)
-    # Get both polarity and subjectivity
-    polarity = blob.sentiment.polarity
-    subjectivity = blob.sentiment.subjectivity
-    
-    # Weight the sentiment by subjectivity
-    # This helps distinguish between factual and opinion-based content
-    weighted_sentiment = polarity * (0.5 + 0.5 * subjectivity)
-    
-    return weighted_sentiment
-
-def create_sentiment_udf():
-    """Create UDF for sentiment analysis with TextBlob"""
-    def get_sentiment(text):
-        if text is None:
-            return None
-        return analyze_sentiment(text)
-    
-    return udf(get_sentiment, DoubleType())
+def _score_texts(texts):
+    """Score a batch of texts, keeping missing texts as NaN"""
+    return np.array(
+        [np.nan if text is None else analyze_sentiment(clean_text(text)) for text in texts],
+        dtype=np.float64
+    )
+
+@pandas_udf(StructType([
+    StructField("title_sentiment", DoubleType(), True),
+    StructField("description_sentiment", DoubleType(), True),
+    StructField("overall_sentiment", DoubleType(), True),
+    StructField("sentiment_label", StringType(), True)
+]))
+def sentiment_udf(titles: pd.Series, descriptions: pd.Series) -> pd.DataFrame:
+    """Vectorized sentiment UDF, scoring titles and descriptions in one pass per Arrow batch"""
+    title_sentiment = _score_texts(titles)
+    description_sentiment = _score_texts(descriptions)
+    overall_sentiment = (title_sentiment + description_sentiment) / 2
+    sentiment_label = np.where(overall_sentiment >= 0.1, "positive",
+                               np.where(overall_sentiment <= -0.1, "negative", "neutral"))
+    return pd.DataFrame({
+        "title_sentiment": title_sentiment,
+        "description_sentiment": description_sentiment,
+        "overall_sentiment": overall_sentiment,
+        "sentiment_label": sentiment_label
+    })
 
 def process_batch(df, epoch_id):
     """Process each batch of news data with sentiment analysis"""
+    sentiment_df = None
     try:
-        if df.rdd.isEmpty():
+        if not df.take(1):
             print(f"Batch {epoch_id}: No data received")
             return
         
         print(f"\nProcessing batch {epoch_id}")
         
-        # Register sentiment UDF
-        sentiment_udf = create_sentiment_udf()
-        
-        # Calculate sentiment scores
+        # Calculate sentiment scores, persisted so the UDF runs once for all
+        # the actions below
         sentiment_df = df \
-            .withColumn("title_sentiment", sentiment_udf("title")) \
-            .withColumn("description_sentiment", sentiment_udf("description")) \
-            .withColumn("overall_sentiment", 
-                       (col("title_sentiment") + col("description_sentiment")) / 2) \
-            .withColumn("sentiment_label", 
-                       when(col("overall_sentiment") >= 0.1, "positive")
-                       .when(col("overall_sentiment") <= -0.1, "negative")
-                       .otherwise("neutral"))
+            .withColumn("sentiment", sentiment_udf("title", "description")) \
+            .select("*", "sentiment.*") \
+            .drop("sentiment") \
+            .persist(StorageLevel.MEMORY_AND_DISK)
         
-        # Calculate sentiment statistics per company
+        # Calculate sentiment statistics per company from 0/1 indicator
+        # columns (a missing score counts as neither positive nor negative)
         company_sentiment = sentiment_df \
+            .withColumn("is_positive",
+                        coalesce((col("overall_sentiment") >= 0.1).cast("int"), lit(0))) \
+            .withColumn("is_negative",
+                        coalesce((col("overall_sentiment") <= -0.1).cast("int"), lit(0))) \
             .groupBy("company") \
             .agg(
                 avg("overall_sentiment").alias("avg_sentiment"),
                 count("*").alias("article_count"),
-                avg(when(col("sentiment_label") == "positive", 1).otherwise(0))
-                    .alias("positive_ratio"),
-                avg(when(col("sentiment_label") == "negative", 1).otherwise(0))
-                    .alias("negative_ratio")
+                avg("is_positive").alias("positive_ratio"),
+                avg("is_negative").alias("negative_ratio")
             )
         
         print("\nCompany Sentiment Analysis:")
@@ -120,15 +149,15 @@ def process_batch(df, epoch_id):
         # Show most positive and negative articles
         print("\nMost Positive Articles:")
         sentiment_df \
-            .orderBy(desc("overall_sentiment")) \
             .select("company", "title", "overall_sentiment") \
+            .orderBy(desc("overall_sentiment")) \
             .limit(3) \
             .show(truncate=False)
             
         print("\nMost Negative Articles:")
         sentiment_df \
-            .orderBy("overall_sentiment") \
             .select("company", "title", "overall_sentiment") \
+            .orderBy("overall_sentiment") \
             .limit(3) \
             .show(truncate=False)
         
@@ -137,47 +166,60 @@ def process_batch(df, epoch_id):
         
     except Exception as e:
         print(f"Error processing batch {epoch_id}: {str(e)}")
+    finally:
+        if sentiment_df is not None:
+            sentiment_df.unpersist()
+
+def _get_cassandra_session():
+    """Return the shared Cassandra session, connecting on first use"""
+    global _cassandra_session
+    with _cassandra_lock:
+        if _cassandra_session is None:
+            cluster = Cluster(['localhost'], port=9042)
+            _cassandra_session = cluster.connect()
+        return _cassandra_session
+
+def _ensure_table(keyspace: str, table: str):
+    """Create the sentiment table once per process if it doesn't exist"""
+    session = _get_cassandra_session()
+    with _cassandra_lock:
+        if (keyspace, table) in _created_tables:
+            return
+        create_table_query = f"""
+        CREATE TABLE IF NOT EXISTS {keyspace}.{table} (
+            company text,
+            timestamp timestamp,
+            description text,
+            description_sentiment float,
+            overall_sentiment float,
+            sentiment_label text,
+            title text,
+            title_sentiment float,
+            PRIMARY KEY (company, timestamp)
+        )"""
+        session.execute(create_table_query)
+        _created_tables.add((keyspace, table))
 
 def save_to_cassandra(df: DataFrame, keyspace: str, table: str):
     """Save sentiment analysis results to Cassandra"""
-    # Connect to the Cassandra cluster
-    cluster = Cluster(['localhost'], port=9042)
-    session = cluster.connect(keyspace)
-
     # Create the table if it doesn't exist
-    create_table_query = f"""
-    CREATE TABLE IF NOT EXISTS {table} (
-        company text,
-        timestamp timestamp,
-        description text,
-        description_sentiment float,
-        overall_sentiment float,
-        sentiment_label text,
-        title text,
-        title_sentiment float,
-        PRIMARY KEY (company, timestamp)
-    )"""
-    session.execute(create_table_query)
-
-    # Insert data
-    insert_query = session.prepare(
-        f"""INSERT INTO {table} 
-            (company,timestamp, description, description_sentiment, overall_sentiment, sentiment_label, title, title_sentiment)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
-    )
+    _ensure_table(keyspace, table)
 
-    # Insert each row
-    for row in df.collect():
-        session.execute(insert_query, (
-            row.company,
-            row.fetch_timestamp,
-            row.description,
-            row.description_sentiment,
-            row.overall_sentiment,
-            row.sentiment_label,
-            row.title,
-            row.title_sentiment
-        ))
+    # Write rows from the executors through the Spark Cassandra Connector
+    df.select(
+        "company",
+        col("fetch_timestamp").alias("timestamp"),
+        "description",
+        "description_sentiment",
+        "overall_sentiment",
+        "sentiment_label",
+        "title",
+        "title_sentiment"
+    ).write \
+        .format("org.apache.spark.sql.cassandra") \
+        .mode("append") \
+        .options(keyspace=keyspace, table=table) \
+        .save()
 
     print(f"Sentiment data saved to table {table} under keyspace {keyspace}.")
 
@@ -200,13 +242,15 @@ def start_streaming():
         spark = create_spark_session()
         print("Spark session created successfully")
         
-        # Define schema for incoming news data
+        # Ship the scoring module so executors import it instead of
+        # unpickling the helpers from __main__
+        spark.sparkContext.addPyFile(str(Path(__file__).with_name("sentiment_scoring.py")))
+        
+        # Define schema for incoming news data, limited to the fields used
+        # downstream (source, url and published_at are not needed)
         schema = StructType([
             StructField("title", StringType(), True),
             StructField("description", StringType(), True),
-            StructField("source", StringType(), True),
-            StructField("url", StringType(), True),
-            StructField("published_at", TimestampType(), True),
             StructField("fetch_timestamp", TimestampType(), True),
             StructField("company", StringType(), True)
         ])
@@ -218,19 +262,20 @@ def start_streaming():
             .option("kafka.bootstrap.servers", "localhost:9092") \
             .option("subscribe", "stock_news") \
             .option("startingOffsets", "latest") \
+            .option("maxOffsetsPerTrigger", MAX_OFFSETS_PER_TRIGGER) \
             .load()
         
         # Parse JSON data
         parsed_df = df.select(
             from_json(col("value").cast("string"), schema).alias("data")
-        ).select("data.*")
+        ).select("data.title", "data.description", "data.fetch_timestamp", "data.company")
         
         # Process the stream
         query = parsed_df \
             .writeStream \
             .foreachBatch(process_batch) \
             .outputMode("update") \
-            .trigger(processingTime='10 seconds') \
+            .trigger(processingTime=BATCH_INTERVAL) \
             .start()
         
         print("Started streaming. Waiting for news data...")